@@ -1 +1,2 @@
-from .notebook import Notebook
+from .notebook import Notebook, Plan
+from .utils import CellLimitError, CellTimeoutError, CellCPUTimeError, CellMemoryError
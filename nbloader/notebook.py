@@ -1,6 +1,12 @@
 import os
 import io
+import sys
+import gc
+import weakref
 import types
+import builtins
+import hashlib
+import difflib
 # import copy
 from contextlib import contextmanager
 import datetime
@@ -15,20 +21,28 @@ from .utils import *
 
 try:
     import matplotlib.pyplot as plt
+    from matplotlib._pylab_helpers import Gcf
     HAS_MATPLOTLIB = True
 except ImportError:
     HAS_MATPLOTLIB = False
 
 
+def _open_figures():
+    '''Get all open matplotlib figures, without changing the current one.'''
+    return {manager.canvas.figure for manager in Gcf.get_all_fig_managers()}
+
+
 class Notebook(object):
 
     blacklist = {'__skip__'}
     close_blocks_at_headings = True
     tag_marker = '##'
 
+    _frozen_blacklist = frozenset() # a hashable copy of blacklist, for plan cache keys
+
     def __init__(self, nb_path, ns=None, nb_dir=None,
                  init=True, tag_md=True,
-                 autorefresh=False,
+                 autorefresh=False, minimal_ns=False,
                  ast_node_interactivity='none'):
         '''Load a Jupyter Notebook as an object.
 
@@ -42,6 +56,8 @@ class Notebook(object):
             nb_dir (str, optional): the directory to run commands from this notebook in.
             close_blocks_at_headings (bool): Implicitly close a block when a heading is reached.
                 This only applies if tag_md == True.
+            minimal_ns (bool): Don't add IPython's history variables (In, Out, _ih, ...)
+                to the namespace on restart. Default False.
 
         '''
         # notebook source
@@ -59,6 +75,7 @@ class Notebook(object):
 
         # output
         self.auto_init = init
+        self.minimal_ns = minimal_ns
 
         # setup shell
         self.ast_node_interactivity = ast_node_interactivity
@@ -134,22 +151,61 @@ class Notebook(object):
 
     '''
 
-    def restart(self, ns=None):
+    def restart(self, ns=None, minimal=None):
         '''Simulate a notebook restart by clearing the namespace.
 
         Arguments:
             ns (dict, optional): the namespace to initialize with. Defaults to an empty dict.
+            minimal (bool, optional): only add what cells need to run, instead of all of
+                IPython's history variables, which can keep large objects alive.
+                Defaults to `minimal_ns`.
         '''
         self.mod = mod = DummyMod()
         self.ns = mod.__dict__ = ns or dict()
         # sys.modules[self.filename] = mod
 
-        with self.environment():
-            self.shell.init_user_ns() # add in all of the ipython history stuff into our ns
+        if self.minimal_ns if minimal is None else minimal:
+            self.ns.setdefault('__name__', '__main__')
+            self.ns.setdefault('__builtins__', builtins)
+            self.ns.setdefault('get_ipython', self.shell.get_ipython) # used by compiled %magics
+        else:
+            with self.environment():
+                self.shell.init_user_ns() # add in all of the ipython history stuff into our ns
 
         self.exec_count = 0
+        self._executed, self._changed = set(), set() # cell indexes, for rerun_changed
+        self._figures = weakref.WeakSet() # figures opened by our cells, closed by reset()
+        # reset() won't remove these. The cells are remapped by refresh().
+        self._baseline_names, self._baseline_cells = set(self.ns), set()
         if self.auto_init:
             self.run_tag('__init__', strict=False)
+            self._baseline_names, self._baseline_cells = set(self.ns), set(self._executed)
+        return self
+
+    def reset(self, keep=()):
+        '''Delete the variables created by the notebook and free their memory.
+
+        Unlike `restart`, this keeps the same namespace and doesn't rerun __init__.
+        Variables that were in the namespace before the notebook ran, or that
+        were defined by __init__, are kept.
+
+        Arguments:
+            keep (list): names of extra variables to keep.
+        '''
+        keep = self._baseline_names.union(keep)
+        for name in [name for name in self.ns if name not in keep]:
+            del self.ns[name]
+        # __init__ cells that were edited since they ran still need to be rerun
+        self._executed &= self._baseline_cells
+        self._changed &= self._baseline_cells
+
+        # the last traceback holds references to the variables in its frames
+        sys.last_type = sys.last_value = sys.last_traceback = None
+        if HAS_MATPLOTLIB:
+            for fig in list(self._figures):
+                plt.close(fig) # does nothing if it was already closed
+        self._figures = weakref.WeakSet()
+        gc.collect()
         return self
 
     def refresh(self, on_changed=False):
@@ -163,9 +219,8 @@ class Notebook(object):
                 return self
             else:
                 print('Notebook last updated at {}. Refreshing.'.format(dtstr))
-        self.timestamp = ts
 
-        self.cells = []
+        cells = []
         self.md_tags = []
         self.block_tag = None
 
@@ -182,12 +237,56 @@ class Notebook(object):
 
             elif cell.cell_type == 'code' and cell.source:
                 source = self._compile_code(cell.source, i)
-                self.cells.append({'source': cell.source, 'code': source,
-                                   'tags': self._cell_tags(cell),
-                                   'md_tags': tuple(self.md_tags)})
-
+                tags = self._cell_tags(cell)
+                try:
+                    limits = get_tag_limits(tags)
+                except ValueError as e:
+                    raise ValueError('Cell {} of {}: {}'.format(i, self.nb_path, e)) from None
+                cells.append({'source': cell.source, 'code': source, 'index': i,
+                              'hash': hashlib.sha1(cell.source.encode('utf-8')).hexdigest(),
+                              'tags': tags, 'limits': limits,
+                              'md_tags': tuple(self.md_tags)})
+
+        # only swap in the new cells once the whole notebook has loaded, so that
+        # a bad cell leaves the notebook as it was and is retried on the next refresh.
+        self.timestamp = ts
+        old_cells, self.cells = getattr(self, 'cells', []), cells
+        self._plans = {} # cached execution plans are only valid for these cells
+        self._diff_cells(old_cells)
         return self
 
+    def _diff_cells(self, old_cells):
+        '''Carry over which cells have been run to the refreshed cells,
+        and mark the ones that were edited since they were run as changed.'''
+        executed, changed = getattr(self, '_executed', set()), getattr(self, '_changed', set())
+        baseline = getattr(self, '_baseline_cells', set())
+        self._executed, self._changed, self._baseline_cells = set(), set(), set()
+
+        matcher = difflib.SequenceMatcher(None, [cell['hash'] for cell in old_cells],
+                                          [cell['hash'] for cell in self.cells], autojunk=False)
+        for op, i1, i2, j1, j2 in matcher.get_opcodes():
+            if op == 'equal':
+                for old, new in zip(old_cells[i1:i2], self.cells[j1:j2]):
+                    for before, after in ((executed, self._executed), (changed, self._changed),
+                                          (baseline, self._baseline_cells)):
+                        if old['index'] in before:
+                            after.add(new['index'])
+
+            elif op == 'replace':
+                # edited cells only need to be rerun if their old version was
+                if any(old['index'] in executed or old['index'] in changed
+                       for old in old_cells[i1:i2]):
+                    self._changed.update(new['index'] for new in self.cells[j1:j2])
+                # edited __init__ cells are still part of what reset() keeps
+                if any(old['index'] in baseline for old in old_cells[i1:i2]):
+                    self._baseline_cells.update(new['index'] for new in self.cells[j1:j2])
+
+            elif op == 'insert':
+                # new cells are run if they were added next to a cell that was run
+                if any(old['index'] in executed or old['index'] in changed
+                       for old in old_cells[max(i1 - 1, 0):i1 + 1]):
+                    self._changed.update(new['index'] for new in self.cells[j1:j2])
+
     def _compile_code(self, source, i=0):
         # translate all magic % commands to code
         source = self.shell.input_transformer_manager.transform_cell(source)
@@ -269,13 +368,33 @@ class Notebook(object):
                 # self.shell.user_mod = orig_mod
                 self.shell.ast_node_interactivity = ast_node_interactivity
 
-    def _execute_cell(self, cell):
-        '''Execute a single cell.'''
+    def _execute_cell(self, cell, **limits):
+        '''Execute a single cell.
+
+        Arguments:
+            cell (dict): the cell to run.
+            **limits: default resource limits (timeout, cpu_time, max_address_space).
+                These are overridden by limit tags on the cell, e.g. `__timeout=30__`.
+        '''
         self.exec_count += 1
 
         ## The original way
 
-        exec(cell['code'], self.ns)
+        figures = _open_figures() if HAS_MATPLOTLIB else None
+        limits = dict(limits, **cell.get('limits', {}))
+        try:
+            if any(limits.values()):
+                with resource_limits(name=self._cell_name(cell), **limits):
+                    exec(cell['code'], self.ns)
+            else:
+                exec(cell['code'], self.ns)
+        finally:
+            if HAS_MATPLOTLIB:
+                self._figures.update(_open_figures() - figures)
+
+        if cell.get('index') is not None: # only once it succeeded, for rerun_changed
+            self._executed.add(cell['index'])
+            self._changed.discard(cell['index'])
 
         if HAS_MATPLOTLIB:
             if plt.gcf().axes:
@@ -298,37 +417,48 @@ class Notebook(object):
             for cell in cells:
                 yield cell
 
-    def _run(self, cells, **kw):
-        '''Run all cells passed.'''
+    def _cell_name(self, cell):
+        '''Describe a cell by its position and heading path, for error messages.'''
+        name = 'Cell {}'.format(cell['index']) if cell.get('index') is not None else 'Cell'
+        if cell.get('md_tags'):
+            name += ' ({})'.format(' > '.join(heading for level, heading in cell['md_tags']))
+        return '{} of {}'.format(name, self.nb_path)
+
+    def _run(self, cells, timeout=None, cpu_time=None, max_address_space=None, **kw):
+        '''Run all cells passed.
+
+        Arguments:
+            cells (list): the cells to run.
+            timeout (float, optional): wall-clock seconds allowed for each cell.
+            cpu_time (float, optional): CPU seconds allowed for each cell.
+            max_address_space (int, optional): address space ceiling in bytes while running
+                each cell. See `resource_limits` - this is not the same as RSS.
+
+        Raises a subclass of CellLimitError naming the cell if a limit is exceeded.
+        '''
+        limits = dict(timeout=timeout, cpu_time=cpu_time, max_address_space=max_address_space)
         for cell in self._iter_cells(cells, **kw):
-            result = self._execute_cell(cell)
+            result = self._execute_cell(cell, **limits)
             if result.error_in_exec and not isinstance(result.error_in_exec, GeneratorExit):
                 result.raise_error()
                 break
 
         return self
 
-    def run_code(self, source):
+    def run_code(self, source, **limits):
         compiled = self._compile_code(source)
-        self._execute_cell({'source': source, 'code': compiled, 'tags': [None]})
+        self._execute_cell({'source': source, 'code': compiled, 'tags': [None]}, **limits)
 
     @refresh_prior
     def run_all(self, blacklist=None, **kw):
         '''Run all cells (excluding those in the blacklist).'''
-        cells = filter_blacklist(self.cells, blacklist, self.blacklist)
-        self._run(cells, **kw)
+        self._run(self._get_plan('all', None, None, False, blacklist).cells, **kw)
         return self
 
     @refresh_prior
     def run_tag(self, tag, strict=True, blacklist=None, **kw):
         '''Run all cells matching a tag.'''
-        if isinstance(tag, str):
-            tag = (tag,)
-        cells = [cell for cell in self.cells if all(t in cell['tags'] for t in tag)]
-        assert cells or not strict, 'Tag {} found'.format(tag)
-
-        cells = filter_blacklist(cells, blacklist, self.blacklist, tag)
-        self._run(cells, **kw)
+        self._run(self._get_plan('tag', tag, None, strict, blacklist).cells, **kw)
         return self
 
     # @refresh_prior
@@ -345,23 +475,145 @@ class Notebook(object):
     @refresh_prior
     def run_before(self, tag, include=False, strict=True, blacklist=None, **kw):
         '''Run all cells before a tag.'''
-        i = get_tag_index(self.cells, tag, end=include, strict=strict)
-
-        if i: # otherwise, there's nothing before
-            cells = filter_blacklist(self.cells[:i], blacklist, self.blacklist)
-            self._run(cells, **kw)
+        self._run(self._get_plan('before', tag, include, strict, blacklist).cells, **kw)
         return self
 
     @refresh_prior
     def run_after(self, tag, include=True, strict=True, blacklist=None, **kw):
         '''Run all cells after a matching tag.'''
-        i = get_tag_index(self.cells, tag, end=not include, strict=strict)
+        self._run(self._get_plan('after', tag, include, strict, blacklist).cells, **kw)
+        return self
 
-        if i: # otherwise, there's nothing after
-            cells = filter_blacklist(self.cells[i:], blacklist, self.blacklist)
-            self._run(cells, **kw)
+    def rerun_changed(self, blacklist=None, **kw):
+        '''Rerun the cells that were edited since they were last run,
+        as well as any cells that have been run that use names they define.
+
+        If an edited cell modifies a variable in place (e.g. `data.append(x)`),
+        the cell that defined the variable is rerun first, so that the change
+        isn't applied twice.
+
+        This refreshes the notebook from file first.
+        '''
+        self.refresh(on_changed=True)
+
+        rerun = set()
+        for i, cell in enumerate(self.cells):
+            if cell['index'] in self._changed:
+                rerun.add(cell['index'])
+                stores, mutations, loads = self._cell_names(cell)
+                for name in self._mutated_names(mutations) - stores:
+                    defining = next((
+                        prev for prev in reversed(self.cells[:i])
+                        if (prev['index'] in self._executed or prev['index'] in self._changed)
+                        and name in self._cell_names(prev)[0]), None)
+                    if defining:
+                        rerun.add(defining['index'])
+
+        cells, dirty = [], set()
+        for cell in self.cells:
+            stores, mutations, loads = self._cell_names(cell)
+            if cell['index'] in rerun or cell['index'] in self._executed and (
+                    loads & dirty or '*' in dirty): # * imports could define anything
+                cells.append(cell)
+                dirty |= stores | self._mutated_names(mutations)
+
+        cells = filter_blacklist(cells, blacklist, self.blacklist)
+        # cells are unmarked as they succeed, so if one fails, it and
+        # the cells after it will still be rerun next time.
+        self._changed.update(cell['index'] for cell in cells)
+        self._run(cells, **kw)
         return self
 
+    def _cell_names(self, cell):
+        '''Get the names a cell defines, modifies, and uses.'''
+        if 'names' not in cell:
+            source = self.shell.input_transformer_manager.transform_cell(cell['source'])
+            cell['names'] = get_names(source)
+        return cell['names']
+
+    def _mutated_names(self, names):
+        '''Drop modules from names modified in place - `math.sqrt(x)` doesn't change `math`.'''
+        return {name for name in names if not isinstance(self.ns.get(name), types.ModuleType)}
+
+    '''
+
+    Execution Plans
+
+    '''
+
+    @refresh_prior
+    def plan(self, tag=None, kind=None, include=None, strict=True, blacklist=None):
+        '''Get a reusable execution plan for a selection of cells.
+
+        Plans are cached by their selection, so asking for the same selection
+        again is cheap. The cache is cleared whenever the notebook is refreshed.
+
+        Example:
+            step = notebook.plan('train step', blacklist='__plot__')
+            for i in range(100):
+                step.run()
+
+        Arguments:
+            tag (str|tuple, optional): the tag(s) to select.
+            kind (str, optional): one of 'all', 'tag', 'before', 'after'.
+                Defaults to 'tag' if a tag is given, otherwise 'all'.
+            include (bool, optional): for 'before'/'after', whether to include
+                the tagged cell. Defaults to the same as `run_before`/`run_after`.
+            strict (bool): assert that the tag exists. Default True.
+            blacklist (str|tuple|False, optional): see `filter_blacklist`.
+        '''
+        if kind is None:
+            kind = 'all' if tag is None else 'tag'
+        assert kind in ('all', 'tag', 'before', 'after'), 'Unknown plan kind {}'.format(kind)
+        assert tag is not None or kind == 'all', 'A tag is required for {} plans'.format(kind)
+        if include is None and kind in ('before', 'after'):
+            include = kind == 'after'
+        return self._get_plan(kind, tag, include, strict, blacklist)
+
+    def _plan_key(self, kind, tag, include, strict, blacklist):
+        '''Normalize a selection into a plan cache key.'''
+        if isinstance(tag, str):
+            tag = (tag,)
+        elif tag is not None:
+            tag = tuple(tag)
+        if isinstance(blacklist, str):
+            blacklist = frozenset((blacklist,))
+        elif not (blacklist is None or blacklist is False):
+            blacklist = frozenset(blacklist)
+        # the class blacklist can be changed at any time, so it's part of the key too.
+        # comparing doesn't allocate, so only copy it when it was changed.
+        if self._frozen_blacklist != self.blacklist:
+            self._frozen_blacklist = frozenset(self.blacklist)
+        return kind, tag, include, strict, blacklist, self._frozen_blacklist
+
+    def _get_plan(self, kind, tag, include, strict, blacklist):
+        '''Get a cached plan or build a new one.'''
+        key = self._plan_key(kind, tag, include, strict, blacklist)
+        try:
+            return self._plans[key]
+        except KeyError:
+            plan = self._plans[key] = Plan(self, key, self._select_cells(*key[:-1]))
+            return plan
+
+    def _select_cells(self, kind, tag, include, strict, blacklist):
+        '''Select the cells for a plan.'''
+        if kind == 'all':
+            return filter_blacklist(self.cells, blacklist, self.blacklist)
+
+        if kind == 'tag':
+            cells = [cell for cell in self.cells if all(t in cell['tags'] for t in tag)]
+            assert cells or not strict, 'Tag {} found'.format(tag)
+            return filter_blacklist(cells, blacklist, self.blacklist, tag)
+
+        if kind == 'before':
+            i = get_tag_index(self.cells, tag, end=include, strict=strict)
+            # otherwise, there's nothing before
+            return filter_blacklist(self.cells[:i], blacklist, self.blacklist) if i else []
+
+        i = get_tag_index(self.cells, tag, end=not include, strict=strict)
+        # otherwise, there's nothing after
+        return filter_blacklist(self.cells[i:], blacklist, self.blacklist) if i else []
+
     '''
 
     Utils/Housekeeping
@@ -386,10 +638,67 @@ class Notebook(object):
     #     return sliced_nb
 
     def __del__(self):
-        self.run_tag('__del__', strict=False)
+        if hasattr(self, 'ns'): # otherwise, __init__ failed
+            self.run_tag('__del__', strict=False)
 
     def __getstate__(self):
         return self.nb_path, self.ns
 
     def __setstate__(self, d):
         self.nb_path, self.ns = d
+
+
+class Plan(object):
+    '''An immutable selection of cells that can be run repeatedly.
+
+    Get one using `Notebook.plan(...)`. If the notebook is refreshed, the plan
+    will be rebuilt from the new cells when it is run.
+
+    Plans only keep a weak reference to their notebook so that caching them
+    doesn't keep the notebook (and its namespace) alive.
+    '''
+    __slots__ = ('_notebook', 'key', 'cells')
+
+    def __init__(self, notebook, key, cells):
+        self._notebook = weakref.ref(notebook)
+        self.key = key
+        self.cells = tuple(cells)
+
+    def __repr__(self):
+        kind, tag = self.key[:2]
+        return '<Plan({}{}) {} cells>'.format(
+            kind, ' {}'.format(tag) if tag else '', len(self.cells))
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __iter__(self):
+        return iter(self.cells)
+
+    @property
+    def tags(self):
+        '''The tags of each cell in the plan.'''
+        return [cell['tags'] for cell in self.cells]
+
+    @property
+    def notebook(self):
+        notebook = self._notebook()
+        if notebook is None:
+            raise ReferenceError('The notebook for this plan has been deleted.')
+        return notebook
+
+    @property
+    def stale(self):
+        '''Whether the notebook was refreshed or its blacklist changed since the plan was built.'''
+        notebook = self.notebook
+        return notebook._plans.get(notebook._plan_key(*self.key[:-1])) is not self
+
+    def run(self, **kw):
+        '''Run all cells in the plan.'''
+        notebook = self.notebook
+        if notebook.autorefresh:
+            notebook.refresh(on_changed=True)
+
+        plan = notebook._get_plan(*self.key[:-1]) if self.stale else self
+        notebook._run(plan.cells, **kw)
+        return notebook
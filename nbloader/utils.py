@@ -1,7 +1,17 @@
 import os
+import re
+import ast
+import time
+import signal
+import threading
 from functools import wraps
 from contextlib import contextmanager
 
+try:
+    import resource
+except ImportError: # windows
+    resource = None
+
 
 
 @contextmanager
@@ -76,6 +86,169 @@ def filter_blacklist(cells, blacklist=None, default_blacklist=None, include=None
 
 
 
+def _base_name(node):
+    '''Get the variable at the base of an expression like `a.b[0].c`.'''
+    while isinstance(node, (ast.Attribute, ast.Subscript)):
+        node = node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+def get_names(source):
+    '''Get the names that some code assigns, the names it may modify in place,
+    and the names it reads.
+
+    This errs on the side of too many names:
+     - names assigned anywhere (including inside functions) count as assigned.
+     - assigning to an attribute or item (`df['c'] = ...`, `obj.x = ...`) or calling
+       a method (`data.append(x)`) counts as modifying the base variable.
+     - `from m import *` is returned as the assigned name '*', meaning it may
+       define anything.
+
+    Returns:
+        stores (set), mutations (set), loads (set)
+    '''
+    stores, mutations, loads = set(), set(), set()
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Name):
+            (loads if isinstance(node.ctx, ast.Load) else stores).add(node.id)
+        elif isinstance(node, (ast.Attribute, ast.Subscript)) and not isinstance(node.ctx, ast.Load):
+            mutations.add(_base_name(node))
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            mutations.add(_base_name(node.func.value))
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            stores.add(node.name)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            stores.add(node.name)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            stores.update((alias.asname or alias.name).split('.')[0] for alias in node.names)
+    mutations.discard(None)
+    return stores, mutations, loads
+
+
+
+class CellLimitError(Exception):
+    '''A cell exceeded one of its resource limits.'''
+
+class CellTimeoutError(CellLimitError):
+    '''A cell ran longer than its wall-clock timeout.'''
+
+class CellCPUTimeError(CellLimitError):
+    '''A cell used more CPU time than allowed.'''
+
+class CellMemoryError(CellLimitError, MemoryError):
+    '''A cell allocated more memory than allowed.'''
+
+
+LIMIT_TAG = re.compile(r'^__(timeout|cpu_time|max_address_space)=([^_]+)__$')
+MEMORY_SIZE = re.compile(r'^([\d.]+)([kmg]?)b?$')
+MEMORY_UNITS = {'': 1, 'k': 1024, 'm': 1024**2, 'g': 1024**3}
+
+def get_tag_limits(tags):
+    '''Get resource limits from cell tags like `__timeout=30__` or `__max_address_space=2G__`.'''
+    limits = {}
+    for tag in tags:
+        match = tag and LIMIT_TAG.match(tag)
+        if match:
+            name, value = match.groups()
+            try:
+                if name == 'max_address_space':
+                    size = MEMORY_SIZE.match(value.lower())
+                    if not size:
+                        raise ValueError(value)
+                    limits[name] = int(float(size.group(1)) * MEMORY_UNITS[size.group(2)])
+                else:
+                    limits[name] = float(value)
+                if not 0 < limits[name] < float('inf'): # also catches nan
+                    raise ValueError(value)
+            except ValueError:
+                raise ValueError('Invalid limit tag "{}". Expected {}.'.format(
+                    tag, 'a size like 512M or 2G' if name == 'max_address_space'
+                    else 'a positive number of seconds'))
+    return limits
+
+def _limit_handler(exc, msg, outer_handler=None):
+    '''Make a signal handler that raises a limit error, or defers to an enclosing limit
+    if its timer was due first.'''
+    def handler(signum, frame):
+        if outer_handler is not None:
+            return outer_handler(signum, frame)
+        raise exc(msg)
+    return handler
+
+@contextmanager
+def resource_limits(timeout=None, cpu_time=None, max_address_space=None, name='cell'):
+    '''Limit the wall-clock time, CPU time, and address space used inside the block.
+
+    Limits can be nested (e.g. a notebook loaded by another notebook). Enclosing
+    timers keep running and are restored with their remaining time afterwards.
+
+    Timeouts use interval timers and signal handlers, so they only work on Unix,
+    and only in the main thread. Otherwise, this raises RuntimeError.
+
+    Arguments:
+        timeout (float, optional): wall-clock seconds before raising CellTimeoutError.
+        cpu_time (float, optional): CPU seconds before raising CellCPUTimeError.
+        max_address_space (int, optional): the process address space ceiling in bytes
+            (RLIMIT_AS). Allocations past it raise CellMemoryError. Note that this
+            counts all virtual memory, including reserved mappings and thread stacks,
+            so it needs to be set well above the memory the process actually uses.
+        name (str): how to describe the block in error messages.
+    '''
+    if not (timeout or cpu_time or max_address_space):
+        yield
+        return
+
+    if (timeout or cpu_time) and not hasattr(signal, 'setitimer'):
+        raise RuntimeError('Time limits are not supported on this platform.')
+    if (timeout or cpu_time) and threading.current_thread() is not threading.main_thread():
+        raise RuntimeError('Time limits can only be used from the main thread.')
+    if max_address_space and resource is None:
+        raise RuntimeError('Memory limits are not supported on this platform.')
+
+    timers = []
+    if timeout:
+        timers.append((signal.SIGALRM, signal.ITIMER_REAL, time.monotonic, timeout,
+                       CellTimeoutError, '{} timed out after {}s.'.format(name, timeout)))
+    if cpu_time: # ITIMER_VIRTUAL counts user CPU time
+        timers.append((signal.SIGVTALRM, signal.ITIMER_VIRTUAL, lambda: os.times().user, cpu_time,
+                       CellCPUTimeError, '{} exceeded {}s of CPU time.'.format(name, cpu_time)))
+
+    started, orig_address_space = [], None
+    try:
+        for sig, timer, clock, seconds, exc, msg in timers:
+            outer_handler = signal.getsignal(sig)
+            outer_timer = signal.getitimer(timer)
+            # an enclosing limit will run out first, so let it raise its own error.
+            outer_first = 0 < outer_timer[0] < seconds and callable(outer_handler)
+            signal.signal(sig, _limit_handler(exc, msg, outer_handler if outer_first else None))
+            started.append((sig, timer, outer_handler, outer_timer, clock, clock()))
+            signal.setitimer(timer, outer_timer[0] if outer_first else seconds)
+
+        if max_address_space:
+            orig_address_space = resource.getrlimit(resource.RLIMIT_AS)
+            hard = orig_address_space[1]
+            resource.setrlimit(resource.RLIMIT_AS, (
+                max_address_space if hard == resource.RLIM_INFINITY
+                else min(max_address_space, hard), hard))
+        yield
+    except MemoryError as e:
+        if max_address_space and not isinstance(e, CellMemoryError):
+            raise CellMemoryError('{} exceeded {} bytes of address space.'.format(
+                name, max_address_space)) from e
+        raise
+    finally:
+        try:
+            for sig, timer, *_ in started:
+                signal.setitimer(timer, 0)
+        finally:
+            if orig_address_space:
+                resource.setrlimit(resource.RLIMIT_AS, orig_address_space)
+            for sig, timer, outer_handler, (remaining, interval), clock, start in reversed(started):
+                signal.signal(sig, signal.SIG_DFL if outer_handler is None else outer_handler)
+                if remaining or interval: # resume the enclosing timer, firing asap if it's overdue
+                    signal.setitimer(timer, max(remaining - (clock() - start), 1e-6), interval)
+
+
+
 def refresh_prior(func):
     @wraps(func)
     def inner(self, *a, **kw):
@@ -0,0 +1,34 @@
+import os
+import pytest
+import nbformat
+from nbformat.v4 import new_notebook, new_code_cell, new_markdown_cell
+from IPython.core.interactiveshell import InteractiveShell
+
+# Notebook needs a running IPython shell
+InteractiveShell.instance()
+
+
+@pytest.fixture
+def write_nb(tmp_path):
+    '''Write a notebook from a list of sources. Sources starting with "#" are markdown.'''
+    path = tmp_path / 'test.ipynb'
+
+    def write(cells):
+        nb = new_notebook(cells=[
+            new_markdown_cell(src) if src.startswith('# ') else new_code_cell(src)
+            for src in cells
+        ])
+        nbformat.write(nb, str(path))
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def rewrite_nb(write_nb):
+    '''Overwrite the notebook, making sure refresh(on_changed=True) notices.'''
+    def rewrite(cells):
+        path = write_nb(cells)
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime + 10))
+        return path
+    return rewrite
@@ -0,0 +1,100 @@
+import os
+import time
+import signal
+import threading
+import pytest
+
+from nbloader import Notebook, CellTimeoutError, CellCPUTimeError, CellMemoryError
+from nbloader.utils import get_tag_limits, resource_limits
+
+
+def test_get_tag_limits():
+    assert get_tag_limits([None, 'a', '__timeout=30__', '__cpu_time=1.5__',
+                           '__max_address_space=2G__']) == {
+        'timeout': 30, 'cpu_time': 1.5, 'max_address_space': 2 * 1024**3}
+    assert get_tag_limits(['__max_address_space=512mb__']) == {'max_address_space': 512 * 1024**2}
+
+
+@pytest.mark.parametrize('tag', ['__timeout=abc__', '__max_address_space=lots__',
+                                 '__timeout=-1__', '__timeout=0__', '__cpu_time=nan__',
+                                 '__timeout=inf__', '__max_address_space=0G__'])
+def test_get_tag_limits_invalid(tag):
+    with pytest.raises(ValueError, match=tag):
+        get_tag_limits([tag])
+
+
+def test_timeout():
+    with pytest.raises(CellTimeoutError, match='my cell'):
+        with resource_limits(timeout=0.05, name='my cell'):
+            time.sleep(1)
+    assert signal.getitimer(signal.ITIMER_REAL) == (0, 0)
+
+
+def test_cpu_time():
+    with pytest.raises(CellCPUTimeError):
+        with resource_limits(cpu_time=0.05):
+            while True:
+                pass
+
+
+def test_address_space():
+    with pytest.raises(CellMemoryError):
+        with resource_limits(max_address_space=1024**3):
+            bytearray(2 * 1024**3)
+    bytearray(10 * 1024**2) # limit is restored
+
+
+def test_nested_timeout_keeps_outer_timer():
+    with pytest.raises(CellTimeoutError, match='outer'):
+        with resource_limits(timeout=0.3, name='outer'):
+            with resource_limits(timeout=5, name='inner'):
+                pass
+            assert 0 < signal.getitimer(signal.ITIMER_REAL)[0] <= 0.3
+            time.sleep(1)
+
+
+def test_nested_timeout_outer_due_first():
+    with pytest.raises(CellTimeoutError, match='outer'):
+        with resource_limits(timeout=0.05, name='outer'):
+            with resource_limits(timeout=5, name='inner'):
+                time.sleep(1)
+
+
+def test_timeout_outside_main_thread():
+    errors = []
+    def run():
+        try:
+            with resource_limits(timeout=1):
+                pass
+        except RuntimeError as e:
+            errors.append(e)
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    assert errors
+
+
+def test_notebook_limits(write_nb):
+    nb = Notebook(write_nb(['# Slow', 'import time', '## __timeout=0.05__\ntime.sleep(1)']))
+    with pytest.raises(CellTimeoutError, match=r'Cell 2 \(Slow\)'):
+        nb.run_all()
+    with pytest.raises(CellTimeoutError):
+        nb.run_code('time.sleep(1)', timeout=0.05)
+
+
+def test_notebook_invalid_limit_tag(write_nb):
+    with pytest.raises(ValueError, match='Cell 1 .*__timeout=soon__'):
+        Notebook(write_nb(['# Slow', '## __timeout=soon__\npass']))
+
+
+def test_invalid_limit_tag_keeps_cells(write_nb):
+    nb = Notebook(write_nb(['a = 1', 'b = 2', 'c = 3']), autorefresh=True)
+    path = write_nb(['a = 1', '## __timeout=soon__\nb = 2', 'c = 3'])
+    st = os.stat(path)
+    os.utime(path, (st.st_atime, st.st_mtime + 10))
+
+    for _ in range(2): # still fails on the next refresh, instead of running a prefix
+        with pytest.raises(ValueError):
+            nb.run_all()
+    assert len(nb.cells) == 3
+    nb.autorefresh = False # the file is still invalid when __del__ runs
@@ -0,0 +1,92 @@
+import pytest
+
+from nbloader import Notebook
+
+
+CELLS = [
+    '# __init__',
+    'import math',
+    '# Run',
+    'big = [0] * 1000\nvalue = math.sqrt(4)',
+]
+
+
+def test_minimal_restart(write_nb):
+    nb = Notebook(write_nb(CELLS), minimal_ns=True)
+    assert not {'In', 'Out', '_ih', '_oh'} & set(nb.ns)
+    assert 'get_ipython' in nb.ns
+    nb.run_tag('Run')
+    assert nb.var('value') == 2
+
+    nb.restart(minimal=False)
+    assert 'Out' in nb.ns
+
+
+def test_reset_keeps_init(write_nb):
+    nb = Notebook(write_nb(CELLS), minimal_ns=True)
+    nb.run_tag('Run')
+    nb.var(extra=1)
+    nb.reset(keep=['extra'])
+    assert 'big' not in nb.ns and 'value' not in nb.ns
+    assert nb.var('extra') == 1
+    assert 'math' in nb.ns
+    nb.run_tag('Run') # __init__ is still in effect
+    assert nb.var('value') == 2
+
+
+def test_reset_keeps_existing_ns(write_nb):
+    ns = {'mine': 1}
+    nb = Notebook(write_nb(CELLS), ns=ns)
+    nb.run_tag('Run').reset()
+    assert ns['mine'] == 1 and 'big' not in ns
+
+
+def test_reset_only_closes_own_figures(write_nb):
+    plt = pytest.importorskip('matplotlib.pyplot')
+    plt.switch_backend('Agg')
+    mine = plt.figure()
+    nb = Notebook(write_nb(['# Plot', 'import matplotlib.pyplot as plt\nfig, ax = plt.subplots()']))
+    nb.run_all()
+    theirs = nb.var('fig').number
+    assert plt.fignum_exists(theirs)
+    nb.reset()
+    assert plt.fignum_exists(mine.number)
+    assert not plt.fignum_exists(theirs)
+    plt.close(mine)
+
+
+def test_reset_ignores_reused_figure_numbers(write_nb):
+    plt = pytest.importorskip('matplotlib.pyplot')
+    plt.switch_backend('Agg')
+    plt.close('all')
+    # a figure without axes is closed right after the cell, freeing its number
+    nb = Notebook(write_nb(['# Plot', 'import matplotlib.pyplot as plt\nfig = plt.figure()']))
+    nb.run_all()
+    number = nb.var('fig').number
+    mine = plt.figure()
+    assert mine.number == number
+    nb.reset()
+    assert plt.fignum_exists(mine.number)
+    plt.close(mine)
+
+
+def test_reset_after_insert_above_init(write_nb, rewrite_nb):
+    cells = ['# __init__', 'import math', '# Run', 'value = math.sqrt(4)']
+    nb = Notebook(write_nb(cells))
+    nb.run_tag('Run')
+    rewrite_nb(['import os'] + cells)
+    nb.refresh(on_changed=True)
+    nb.reset()
+    assert nb._executed == {2} # the __init__ cell, not the new one
+    nb.run_tag('Run')
+    assert nb.var('value') == 2
+
+
+def test_reset_keeps_edited_init_pending(write_nb, rewrite_nb):
+    nb = Notebook(write_nb(['# __init__', 'a = 1', '# Run', 'b = a + 1']))
+    nb.run_tag('Run')
+    rewrite_nb(['# __init__', 'a = 100', '# Run', 'b = a + 1'])
+    nb.refresh(on_changed=True)
+    nb.reset()
+    nb.rerun_changed()
+    assert nb.var('a') == 100
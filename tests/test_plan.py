@@ -0,0 +1,82 @@
+import gc
+import weakref
+import pytest
+
+from nbloader import Notebook, Plan
+
+
+CELLS = [
+    '# Setup',
+    'log = []',
+    '## a\nlog.append("a")',
+    '## a b\nlog.append("ab")',
+    '## skipme\nlog.append("skipme")',
+    '## __skip__\nlog.append("skip")',
+]
+
+
+def test_plan_is_cached(write_nb):
+    nb = Notebook(write_nb(CELLS))
+    plan = nb.plan('a')
+    assert isinstance(plan, Plan)
+    assert len(plan) == 2
+    assert nb.plan(('a',)) is plan
+    assert nb.plan('a', blacklist=['b', 'c']) is nb.plan('a', blacklist=['c', 'b'])
+
+    nb.var(log=[])
+    plan.run()
+    assert nb.var('log') == ['a', 'ab']
+
+
+def test_plan_kinds(write_nb):
+    nb = Notebook(write_nb(CELLS))
+    assert len(nb.plan()) == 4
+    assert len(nb.plan('b', kind='before')) == 2
+    assert len(nb.plan('b', kind='after')) == 2
+    for kind in ('tag', 'before', 'after'):
+        with pytest.raises(AssertionError):
+            nb.plan(kind=kind)
+
+
+def test_plan_invalidated_by_refresh(write_nb):
+    nb = Notebook(write_nb(CELLS))
+    plan = nb.plan('a')
+    nb.refresh()
+    assert plan.stale
+    assert nb.plan('a') is not plan
+
+
+def test_plan_follows_class_blacklist(write_nb):
+    nb = Notebook(write_nb(CELLS))
+    nb.run_tag('Setup')
+    assert 'skipme' in nb.var('log')
+
+    nb.blacklist = nb.blacklist | {'skipme'}
+    nb.restart().run_tag('Setup')
+    assert 'skipme' not in nb.var('log')
+
+
+def test_plan_does_not_keep_notebook_alive(write_nb):
+    nb = Notebook(write_nb(CELLS))
+    plan = nb.plan('a')
+    ref = weakref.ref(nb)
+    gc.disable()
+    try:
+        del nb
+        assert ref() is None
+    finally:
+        gc.enable()
+    with pytest.raises(ReferenceError):
+        plan.run()
+
+
+def test_plan_key_reuses_frozen_blacklist(write_nb):
+    nb = Notebook(write_nb(CELLS))
+    frozen = nb.plan('a').key[-1]
+    assert nb.plan('a').key[-1] is frozen
+
+    nb.blacklist.add('skipme') # modified in place
+    try:
+        assert 'skipme' in nb.plan('a').key[-1]
+    finally:
+        nb.blacklist.discard('skipme')
@@ -0,0 +1,85 @@
+import os
+import pytest
+
+from nbloader import Notebook
+from nbloader.utils import get_names
+
+
+def rewrite(write_nb, cells):
+    path = write_nb(cells)
+    st = os.stat(path)
+    os.utime(path, (st.st_atime, st.st_mtime + 10)) # make sure the change is noticed
+    return path
+
+
+def test_get_names():
+    stores, mutations, loads = get_names('\n'.join([
+        'import os.path',
+        'from a import b as c',
+        'x = y + 1',
+        'def f():\n    return z',
+        'data.append(x)',
+        "df['c'] = 1",
+        'obj.attr.sub = 2',
+        'try:\n    pass\nexcept Exception as err:\n    pass',
+    ]))
+    assert stores == {'os', 'c', 'x', 'f', 'err'}
+    assert mutations == {'data', 'df', 'obj'}
+    assert {'y', 'z', 'data', 'df', 'obj'} <= loads
+
+
+def test_get_names_star_import():
+    assert get_names('from m import *')[0] == {'*'}
+
+
+def test_rerun_changed(write_nb):
+    cells = ['a = 1', 'b = a + 1', 'other = 5', 'c = b * 2', 'log.append(other)']
+    nb = Notebook(write_nb(cells), ns={'log': []})
+    nb.run_all()
+    count = nb.exec_count
+
+    rewrite(write_nb, ['a = 10'] + cells[1:])
+    nb.rerun_changed()
+    assert nb.var('a', 'b', 'c') == (10, 11, 22)
+    assert nb.exec_count == count + 3
+    assert nb.var('log') == [5]
+
+
+def test_rerun_changed_mutation(write_nb):
+    nb = Notebook(write_nb(['data = []', 'data.append(1)', 'n = len(data)']))
+    nb.run_all()
+    rewrite(write_nb, ['data = []', 'data.append(1)\ndata.append(2)', 'n = len(data)'])
+    nb.rerun_changed()
+    assert nb.var('data', 'n') == ([1, 2], 2) # same as a fresh run
+
+
+def test_rerun_changed_skips_module_calls(write_nb):
+    cells = ['import math', 'x = math.sqrt(4)', 'y = math.sqrt(9)', 'z = math.pi']
+    nb = Notebook(write_nb(cells))
+    nb.run_all()
+    count = nb.exec_count
+    rewrite(write_nb, ['import math', 'x = math.sqrt(16)'] + cells[2:])
+    nb.rerun_changed()
+    assert nb.var('x') == 4
+    assert nb.exec_count == count + 1
+
+
+def test_rerun_changed_insert_at_top(write_nb):
+    nb = Notebook(write_nb(['a = 1', 'b = a + 1']))
+    nb.run_all()
+    rewrite(write_nb, ['w = 42', 'a = 1', 'b = a + 1'])
+    nb.rerun_changed()
+    assert nb.var('w') == 42
+
+
+def test_rerun_changed_after_failure(write_nb):
+    nb = Notebook(write_nb(['a = 1', 'b = a + 1', 'c = a + 1']))
+    nb.run_all()
+    rewrite(write_nb, ['a = 10', 'b = a + 1\nraise ValueError', 'c = a + 1'])
+    with pytest.raises(ValueError):
+        nb.rerun_changed()
+    assert nb.var('c') == 2
+
+    rewrite(write_nb, ['a = 10', 'b = a + 1', 'c = a + 1'])
+    nb.rerun_changed()
+    assert nb.var('b', 'c') == (11, 11)